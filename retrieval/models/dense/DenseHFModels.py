@@ -2,40 +2,59 @@ import torch
 from transformers import AutoModel, AutoTokenizer
 import torch.nn.functional as F
 from torch.utils.data import Dataset, DataLoader
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
+import faiss
 from tqdm import tqdm
 from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+import importlib.util
 import os
 
-os.environ["TOKENIZERS_PARALLELISM"] = "false"
-
 
 class QueryDataset(Dataset):
     def __init__(self, queries: Dict[str, Dict[str, str]]):
-        self.queries = queries
+        self.query_ids = list(queries.keys())
+        self.query_texts = list(queries.values())
 
     def __len__(self):
-        return len(self.queries)
+        return len(self.query_ids)
 
     def __getitem__(self, idx):
-        query_id = list(self.queries.keys())[idx]
-        query_text = self.queries[query_id]
-        return query_text, query_id
+        return self.query_texts[idx], self.query_ids[idx]
 
 
 class DenseHFModels:
-    def __init__(self, model_name: str, maxlen: int = 512, batch_size: int = 128, device: str = 'cuda', model_sep: str = "[SEP]"):
+    # corpus rows scored per matmul in exact CUDA search, bounds the [n_queries, chunk] score matrix
+    search_chunk_size = 1 << 20
+
+    def __init__(self, model_name: str, maxlen: int = 512, batch_size: int = 128, device: str = 'cuda', model_sep: str = "[SEP]",
+                 fp16: bool = True, compile_model: bool = False, emb_dtype: type = np.float16,
+                 backend: str = 'torch'):
         """
         initialize model and tokenizer from hf-transformers
         :param model_name: hf-model repo
         :param device: where to run the model
+        :param fp16: run forward pass under float16 autocast (CUDA only)
+        :param compile_model: wrap the model with torch.compile (CUDA only)
+        :param emb_dtype: dtype of returned embeddings, np.float16 halves memory of corpus embeddings
+        :param backend: 'torch' or 'onnx' (onnxruntime via optimum, model is exported once and cached on disk)
         """
-        self.model, self.tokenizer = self.load_model(model_name, device)
+        if backend == 'onnx':
+            self.model, self.tokenizer = self.load_onnx_model(model_name, device)
+        elif backend == 'torch':
+            self.model, self.tokenizer = self.load_model(model_name, device)
+        else:
+            raise ValueError(f"Unknown backend: {backend}")
         self.max_len = maxlen
         self.device = device
+        self.fp16 = fp16 and backend == 'torch' and device.startswith('cuda')
+        self.compile_model = compile_model and backend == 'torch' and device.startswith('cuda')
+        if self.compile_model:
+            self.model = torch.compile(self.model, mode='reduce-overhead', dynamic=True)
         self.batch_size = batch_size
         self.model_sep = model_sep
+        self.emb_dtype = emb_dtype
+        self._corpus_cache = None
 
     def load_model(self, model_name: str, device: str = 'cuda'):
         model = AutoModel.from_pretrained(model_name).to(device)
@@ -44,6 +63,31 @@ class DenseHFModels:
 
         return model, tokenizer
 
+    def load_onnx_model(self, model_name: str, device: str = 'cuda',
+                        cache_dir: str = os.path.join('~', '.cache', 'rusBeIR', 'onnx')):
+        """
+        Loads model exported to ONNX and run with onnxruntime (CUDA execution provider on GPU).
+        Model outputs only last_hidden_state, so it suits average and [CLS] pooling over hidden states.
+        :param model_name: hf-model repo
+        :param device: where to run the model
+        :param cache_dir: where exported models are stored
+        """
+        if importlib.util.find_spec("optimum") is None or importlib.util.find_spec("onnxruntime") is None:
+            raise ImportError("onnx backend requires optimum[onnxruntime] (or optimum[onnxruntime-gpu] for CUDA)")
+        # imported lazily: optimum is slow to import and breaks on transformers versions it does not support
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+
+        provider = 'CUDAExecutionProvider' if device.startswith('cuda') else 'CPUExecutionProvider'
+        onnx_dir = os.path.join(os.path.expanduser(cache_dir), model_name.replace('/', '--'))
+        if os.path.isdir(onnx_dir):
+            model = ORTModelForFeatureExtraction.from_pretrained(onnx_dir, provider=provider)
+        else:
+            model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True, provider=provider)
+            model.save_pretrained(onnx_dir)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+        return model, tokenizer
+
     def encode_queries(self, queries: Dict[str, str], pooling_method: str = "average", prefix: str = ''):
         """
         Encodes queries
@@ -68,10 +112,18 @@ class DenseHFModels:
                corpus: Dict[str, Dict[str, str]],
                top_n: int = 100, 
                data_batch_size: int = 16, 
-               num_workers = 4
+               num_workers = 0,
+               corpus_emb: np.ndarray = None,
+               index_type: str = 'flat'
                ) -> Dict[str, Dict[str, float]]:
-
-        corpus_emb = self.encode_corpus(corpus)
+        """
+        Retrieves top_n documents from corpus for each query
+        :param corpus_emb: precomputed corpus embeddings in corpus order; encoded (and cached) if not given
+        :param index_type: 'flat' for exact search, 'hnsw' or 'ivfpq' for approximate search on large corpora
+        :return: {query_id: {doc_id: score}}
+        """
+        if corpus_emb is None:
+            corpus_emb = self._encode_corpus_cached(corpus)
         corpus_ids = list(corpus.keys())
 
         data_batch_size = data_batch_size
@@ -79,7 +131,11 @@ class DenseHFModels:
         top_n = top_n
 
         query_dataset = QueryDataset(queries)
-        data_loader = DataLoader(query_dataset, batch_size=data_batch_size, num_workers=num_workers, pin_memory=True)
+        # queries are in-memory strings, so worker processes only pay off for very large query sets
+        loader_kwargs = {'persistent_workers': True, 'prefetch_factor': 4} if num_workers > 0 else {}
+        data_loader = DataLoader(query_dataset, batch_size=data_batch_size, num_workers=num_workers, **loader_kwargs)
+
+        index = self._build_index(corpus_emb, index_type=index_type)
 
         results = {}
 
@@ -88,49 +144,153 @@ class DenseHFModels:
 
             query_embs = self.encode_queries(query_dict)
 
-            similarities = cosine_similarity(query_embs, corpus_emb)
+            scores, indices = self._search(index, query_embs, top_n)
 
             for idx, query_id in enumerate(batch_query_ids):
-                query_similarities = similarities[idx].flatten()
-                top_n_indices = query_similarities.argsort()[-top_n:][::-1]
-                top_n_results = {corpus_ids[j]: float(query_similarities[j]) * 100 for j in top_n_indices}
-                results[query_id] = top_n_results
+                results[query_id] = {corpus_ids[j]: float(score) * 100
+                                     for score, j in zip(scores[idx], indices[idx]) if j >= 0}
         return results
 
-    def _get_embeddings(self, texts: List[str], pooling_method: str = 'average'):
+    def _encode_corpus_cached(self, corpus: Dict[str, Dict[str, str]]) -> np.ndarray:
+        """
+        Encodes corpus, reusing embeddings of the previous call if the corpus has not changed
+        :param corpus: corpus to encode
+        :return: np.ndarray with corpus embeddings
+        """
+        # per-document hashes are cheap since str caches its hash; only the int64 buffer of them is kept
+        doc_hashes = np.fromiter((hash((doc_id, doc.get('title'), doc.get('text'))) for doc_id, doc in corpus.items()),
+                                 dtype=np.int64, count=len(corpus))
+        key = hash(doc_hashes.tobytes())
+        if self._corpus_cache is None or self._corpus_cache[0] != key:
+            self._corpus_cache = (key, self.encode_corpus(corpus))
+        return self._corpus_cache[1]
+
+    def _build_index(self, corpus_emb: np.ndarray, index_type: str = 'flat'):
+        """
+        Builds inner-product index over corpus embeddings
+        (embeddings are L2-normalized, so inner product equals cosine similarity)
+        :param corpus_emb: np.ndarray with corpus embeddings
+        :param index_type: 'flat' (exact), 'hnsw' or 'ivfpq' (approximate, faiss on CPU)
+        :return: tensor on device for exact search on CUDA if the corpus fits in GPU memory, faiss index otherwise
+        """
+        if index_type == 'flat' and self.device.startswith('cuda'):
+            # keep float16 embeddings as they are, search precision follows the embeddings
+            gpu_emb = np.ascontiguousarray(corpus_emb, dtype=np.float16 if corpus_emb.dtype == np.float16 else np.float32)
+            free_bytes, _ = torch.cuda.mem_get_info(self.device)
+            # leave half of free memory to the model and query batches; larger corpora fall back to faiss on CPU
+            if gpu_emb.nbytes <= free_bytes // 2:
+                return torch.from_numpy(gpu_emb).to(self.device)
+
+        corpus_emb = np.ascontiguousarray(corpus_emb, dtype=np.float32)
+        n_docs, dim = corpus_emb.shape
+        if index_type == 'flat':
+            index = faiss.IndexFlatIP(dim)
+        elif index_type == 'hnsw':
+            index = faiss.IndexHNSWFlat(dim, 32, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = 200
+            index.hnsw.efSearch = 128
+        elif index_type == 'ivfpq':
+            # 8-bit product quantizer codes are trained with k-means over 256 centroids
+            if n_docs < 256:
+                raise ValueError(f"ivfpq index needs at least 256 documents to train, got {n_docs}; "
+                                 f"use index_type='flat' for small corpora")
+            nlist = min(n_docs, max(1, int(4 * np.sqrt(n_docs))))
+            n_subquantizers = next(m for m in (64, 48, 32, 16, 8, 4, 2, 1) if dim % m == 0)
+            index = faiss.IndexIVFPQ(faiss.IndexFlatIP(dim), dim, nlist, n_subquantizers, 8,
+                                     faiss.METRIC_INNER_PRODUCT)
+            train_ids = np.random.default_rng(0).choice(n_docs, min(n_docs, 256 * nlist), replace=False)
+            index.train(corpus_emb[np.sort(train_ids)])
+            index.nprobe = 16
+        else:
+            raise ValueError(f"Unknown index type: {index_type}")
+
+        index.add(corpus_emb)
+        return index
+
+    def _search(self, index, query_embs: np.ndarray, top_n: int):
+        """
+        Searches top_n nearest corpus embeddings for each query
+        :param index: index built by _build_index
+        :param query_embs: np.ndarray with query embeddings
+        :param top_n: number of documents to return per query
+        :return: (scores, indices) np.ndarrays of shape [n_queries, top_n]; missing hits have index -1
+        """
+        if isinstance(index, torch.Tensor):
+            queries = torch.from_numpy(query_embs).to(self.device, dtype=index.dtype)
+            scores = torch.empty((queries.shape[0], 0), dtype=torch.float32, device=self.device)
+            indices = torch.empty((queries.shape[0], 0), dtype=torch.long, device=self.device)
+            # top_n of every chunk is merged with the running top_n, so only [n_queries, chunk] scores are held at once
+            for start in range(0, index.shape[0], self.search_chunk_size):
+                chunk_scores = (queries @ index[start:start + self.search_chunk_size].T).float()
+                chunk_scores, chunk_indices = torch.topk(chunk_scores, min(top_n, chunk_scores.shape[1]), dim=1)
+                scores = torch.cat([scores, chunk_scores], dim=1)
+                indices = torch.cat([indices, chunk_indices + start], dim=1)
+                scores, order = torch.topk(scores, min(top_n, scores.shape[1]), dim=1)
+                indices = torch.gather(indices, 1, order)
+            return scores.cpu().numpy(), indices.cpu().numpy()
+
+        return index.search(np.ascontiguousarray(query_embs, dtype=np.float32), top_n)
+
+    def _get_embeddings(self, texts: List[str], pooling_method: str = 'average', dtype: type = None):
         """
         Get embeddings for given texts
         :param texts: list of texts to encode
         :param batch_size:
         :param pooling_method: 'average' or 'cls' are available by default
+        :param dtype: dtype of returned embeddings, defaults to self.emb_dtype
         :return: np.ndarray with embeddings
         """
+        dtype = np.dtype(dtype or self.emb_dtype)
+        if not texts:
+            return np.empty((0, self.model.config.hidden_size), dtype=dtype)
+
+        # encode longest texts first so that every batch is padded to similar lengths
+        order = np.argsort([-len(text) for text in texts], kind='stable')
+
+        batches = [[texts[j] for j in order[i:i + self.batch_size]] for i in range(0, len(texts), self.batch_size)]
+
+        out = None
+        # tokenization of the next batch runs in a background thread while the current one is on the device
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            next_batch = executor.submit(self._tokenize, batches[0]) if batches else None
+            for n in tqdm(range(len(batches)), desc="Processing Batches"):
+                batch_dict = next_batch.result()
+                if n + 1 < len(batches):
+                    next_batch = executor.submit(self._tokenize, batches[n + 1])
+                batch_dict = {k: v.to(self.device, non_blocking=True) for k, v in batch_dict.items()}
 
-        embeddings = []
-        for i in tqdm(range(0, len(texts), self.batch_size), desc="Processing Batches"):
-            batch_texts = texts[i:i + self.batch_size]
-            batch_dict = self.tokenizer(batch_texts, max_length=self.max_len, padding=True, truncation=True,
-                                        return_tensors='pt')
-            batch_dict = {k: v.to(self.device) for k, v in batch_dict.items()}
+                with torch.inference_mode(), torch.autocast(device_type='cuda', dtype=torch.float16, enabled=self.fp16):
+                    outputs = self.model(**batch_dict)
+                    if pooling_method == 'average':
+                        batch_embeddings = self._average_pool(outputs, batch_dict['attention_mask'])
+                    elif pooling_method == 'cls':
+                        batch_embeddings = self._cls_pool(outputs)
+                    else:
+                        raise ValueError(f"Unknown pooling method: {pooling_method}")
 
-            with torch.no_grad():
-                outputs = self.model(**batch_dict)
-            if pooling_method == 'average':
-                batch_embeddings = self._average_pool(outputs, batch_dict['attention_mask'])
-            elif pooling_method == 'cls':
-                batch_embeddings = self._cls_pool(outputs)
-            else:
-                raise ValueError(f"Unknown pooling method: {pooling_method}")
+                batch_embeddings = F.normalize(batch_embeddings.float(), p=2, dim=1)
+                if dtype == np.float16:
+                    batch_embeddings = batch_embeddings.half()
+                if out is None:
+                    out = np.empty((len(texts), batch_embeddings.shape[1]), dtype=dtype)
+                # write straight into the input positions of this batch
+                out[order[n * self.batch_size:(n + 1) * self.batch_size]] = batch_embeddings.cpu().numpy()
 
-            batch_embeddings = F.normalize(batch_embeddings, p=2, dim=1)
-            embeddings.append(batch_embeddings.cpu().numpy())
+        return out
 
-        return np.vstack(embeddings)
+    def _tokenize(self, batch_texts: List[str]) -> Dict[str, torch.Tensor]:
+        # compiled graphs are specialized per shape, padding to a multiple of 64 keeps their number small
+        batch_dict = self.tokenizer(batch_texts, max_length=self.max_len, padding=True, truncation=True,
+                                    pad_to_multiple_of=64 if self.compile_model else None, return_tensors='pt')
+        if self.device.startswith('cuda'):
+            batch_dict = {k: v.pin_memory() for k, v in batch_dict.items()}
+        return batch_dict
 
     def _average_pool(self, model_output: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
         last_hidden_states = model_output.last_hidden_state
-        last_hidden = last_hidden_states.masked_fill(~attention_mask[..., None].bool(), 0.0)
-        return last_hidden.sum(dim=1) / attention_mask.sum(dim=1)[..., None]
+        # masked mean as one weighted reduction over tokens, without a masked copy of the hidden states
+        weights = attention_mask / attention_mask.sum(dim=1, keepdim=True).clamp_min(1)
+        return torch.einsum('blh,bl->bh', last_hidden_states, weights.to(last_hidden_states.dtype))
 
     def _cls_pool(self, model_output: torch.Tensor) -> torch.Tensor:
         return model_output.last_hidden_state[:, 0, :]
\ No newline at end of file
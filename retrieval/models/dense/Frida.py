@@ -1,20 +1,29 @@
 from typing import Dict
 from transformers import T5EncoderModel, AutoTokenizer
 from rusBeIR.retrieval.models.dense.DenseHFModels import DenseHFModels
+import numpy as np
 
 class FridaTransformers(DenseHFModels):
     def __init__(self, 
                  model_name: str = "ai-forever/FRIDA", 
                  maxlen: int = 512, 
                  batch_size: int = 128, 
-                 device: str = 'cuda'):
+                 device: str = 'cuda',
+                 fp16: bool = False,
+                 emb_dtype: type = np.float16,
+                 compile_model: bool = False,
+                 backend: str = 'torch'):
         """
         :param model_name: Name of the pre-trained BGE model from HF.
         :param device: Where to run the model ('cuda' or 'cpu').
         :param maxlen: Models max_length
         :param batch_size: Size of batch that process 
+        :param fp16: Run forward pass under float16 autocast (CUDA only). Off by default: T5 activations overflow in float16
+        :param emb_dtype: dtype of returned embeddings
+        :param compile_model: Wrap the model with torch.compile (CUDA only)
+        :param backend: 'torch' or 'onnx' (onnxruntime via optimum)
         """
-        super().__init__(model_name, maxlen=maxlen, batch_size=batch_size, device=device)
+        super().__init__(model_name, maxlen=maxlen, batch_size=batch_size, device=device, fp16=fp16, emb_dtype=emb_dtype, compile_model=compile_model, backend=backend)
 
     def load_model(self, model_name: str, device: str = 'cuda'):
         model = T5EncoderModel.from_pretrained(model_name).to(device)
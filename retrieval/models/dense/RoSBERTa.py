@@ -1,17 +1,22 @@
 from typing import Dict
 from rusBeIR.retrieval.models.dense.DenseHFModels import DenseHFModels
 import torch
+import numpy as np
 
 
 class RoSBERTaModel(DenseHFModels):
-    def __init__(self, model_name: str = 'ai-forever/ru-en-RoSBERTa', maxlen: int = 512, batch_size: int = 128, device: str = 'cuda'):
+    def __init__(self, model_name: str = 'ai-forever/ru-en-RoSBERTa', maxlen: int = 512, batch_size: int = 128, device: str = 'cuda', fp16: bool = True, emb_dtype: type = np.float16, compile_model: bool = False, backend: str = 'torch'):
         """
         :param model_name: Name of the pre-trained BGE model from HF.
         :param device: Where to run the model ('cuda' or 'cpu').
         :param maxlen: Models max_length
         :param batch_size: Size of batch that process 
+        :param fp16: Run forward pass under float16 autocast (CUDA only)
+        :param emb_dtype: dtype of returned embeddings
+        :param compile_model: Wrap the model with torch.compile (CUDA only)
+        :param backend: 'torch' or 'onnx' (onnxruntime via optimum)
         """
-        super().__init__(model_name, maxlen=maxlen, batch_size=batch_size, device=device)
+        super().__init__(model_name, maxlen=maxlen, batch_size=batch_size, device=device, fp16=fp16, emb_dtype=emb_dtype, compile_model=compile_model, backend=backend)
 
     def encode_queries(self, queries: Dict[str, str], pooling_method: str = 'cls', prefix: str = 'search_query: '):
         """
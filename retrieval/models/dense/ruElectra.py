@@ -1,14 +1,19 @@
 from typing import Dict
 import torch
 from rusBeIR.retrieval.models.dense.DenseHFModels import DenseHFModels
+import numpy as np
 
 class ruElectraTransformers(DenseHFModels):
     def __init__(self, 
                  model_name: str = "ai-forever/ruElectra-large", 
                  maxlen: int = 512, 
                  batch_size: int = 128, 
-                 device: str = 'cuda'):
-        super().__init__(model_name, maxlen=maxlen, batch_size=batch_size, device=device)
+                 device: str = 'cuda',
+                 fp16: bool = True,
+                 emb_dtype: type = np.float16,
+                 compile_model: bool = False,
+                 backend: str = 'torch'):
+        super().__init__(model_name, maxlen=maxlen, batch_size=batch_size, device=device, fp16=fp16, emb_dtype=emb_dtype, compile_model=compile_model, backend=backend)
 
     def encode_queries(self, queries: Dict[str, str], pooling_method: str = 'average'):
         """
@@ -8,14 +8,18 @@ import numpy as np
 
 class rusSciTinyModel(DenseHFModels):
     def __init__(self, model_name: str = 'mlsa-iai-msu-lab/sci-rus-tiny', maxlen: int = None, batch_size: int = 128,
-                 device: str = 'cuda'):
+                 device: str = 'cuda', fp16: bool = False, emb_dtype: type = np.float32, compile_model: bool = False, backend: str = 'torch'):
         """
         :param model_name: Name of the pre-trained BGE model from HF.
         :param device: Where to run the model ('cuda' or 'cpu').
         :param maxlen: Models max_length
         :param batch_size: Size of batch that process 
+        :param fp16: Run forward pass under float16 autocast (CUDA only)
+        :param emb_dtype: dtype of returned embeddings
+        :param compile_model: Wrap the model with torch.compile (CUDA only)
+        :param backend: 'torch' or 'onnx' (onnxruntime via optimum)
         """
-        super().__init__(model_name, maxlen=maxlen, batch_size=batch_size, device=device)
+        super().__init__(model_name, maxlen=maxlen, batch_size=batch_size, device=device, fp16=fp16, emb_dtype=emb_dtype, compile_model=compile_model, backend=backend)
 
     def encode_queries(self, queries: Dict[str]):
         """
@@ -39,11 +43,11 @@ class rusSciTinyModel(DenseHFModels):
             batch_texts = texts[i:i + self.batch_size]
             encoded_input = self.tokenizer(batch_texts, padding=True, truncation=True, return_tensors='pt',
                                            max_length=self.max_len).to(self.model.device)
-            with torch.no_grad():
+            with torch.no_grad(), torch.autocast(device_type='cuda', dtype=torch.float16, enabled=self.fp16):
                 model_output = self.model(**encoded_input)
-            sentence_embeddings = self._average_pool(model_output, encoded_input['attention_mask'])
+            sentence_embeddings = self._average_pool(model_output, encoded_input['attention_mask']).float()
             sentence_embeddings = F.normalize(sentence_embeddings, p=2, dim=1)
-            embeddings.append(sentence_embeddings.cpu().detach().numpy())
+            embeddings.append(sentence_embeddings.cpu().detach().numpy().astype(self.emb_dtype, copy=False))
         return np.vstack(embeddings)
 
     def _average_pool(self, model_output, attention_mask):
@@ -1,10 +1,29 @@
 from rusBeIR.beir.retrieval.search.base import BaseSearch
 import bm25s
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 from typing import Dict, List
 
+_TOKEN_RE = re.compile(r"\w+")
+
+def _tokenize_docs(docs: List[Dict[str, str]]) -> List[List[str]]:
+    documents_tokens = []
+    for doc in docs:
+        title = doc.get("title", "")
+        text = doc.get("text", "")
+        content = ((title + " ") if title else "") + (text if text else "")
+        documents_tokens.append(_TOKEN_RE.findall(content.strip().lower()))
+    return documents_tokens
+
 class BM25s(BaseSearch):
-    def __init__(self, method: str, k1: float = None, b: float = None):
+    def __init__(self, method: str, k1: float = None, b: float = None, n_jobs: int = 1):
+        """
+        Args:
+            method: BM25 variant supported by bm25s.
+            k1, b: BM25 parameters, bm25s defaults are used if not given.
+            n_jobs: Number of processes used to tokenize the corpus, -1 for all cores.
+        """
         if k1 is not None and b is not None:
             self.bm25 = bm25s.BM25(method=method, k1=k1, b=b)
         else:
@@ -12,6 +31,7 @@ class BM25s(BaseSearch):
         self.doc_ids: List[str] = []       
         self.doc_id_to_index: Dict[str, int] = {}  
         self.indexed = False                 
+        self.n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
 
     def index(self, corpus: Dict[str, Dict[str, str]]):
         """
@@ -20,21 +40,18 @@ class BM25s(BaseSearch):
         Args:
             corpus: Dictionary of document entries {doc_id: {"title": ..., "text": ...}}
         """
-        documents_tokens: List[List[str]] = []
-        self.doc_ids = []
-        self.doc_id_to_index = {}
-        
-        for doc_id, doc in corpus.items():
-            title = doc.get("title", "")
-            text = doc.get("text", "")
-            content = ((title + " ") if title else "") + (text if text else "")
-            content = content.strip().lower()  
+        self.doc_ids = list(corpus.keys())
+        self.doc_id_to_index = {doc_id: i for i, doc_id in enumerate(self.doc_ids)}
+        docs = list(corpus.values())
 
-            tokens = re.findall(r"\w+", content)
-            documents_tokens.append(tokens)
-
-            self.doc_id_to_index[doc_id] = len(self.doc_ids)
-            self.doc_ids.append(doc_id)
+        if self.n_jobs > 1:
+            # several chunks per process keep workers busy when document lengths are uneven
+            chunk_size = max(1, -(-len(docs) // (self.n_jobs * 4)))
+            chunks = [docs[i:i + chunk_size] for i in range(0, len(docs), chunk_size)]
+            with ProcessPoolExecutor(self.n_jobs) as executor:
+                documents_tokens = [tokens for chunk in executor.map(_tokenize_docs, chunks) for tokens in chunk]
+        else:
+            documents_tokens = _tokenize_docs(docs)
 
         self.bm25.index(documents_tokens)
         self.indexed = True
@@ -61,7 +78,7 @@ class BM25s(BaseSearch):
 
         query_tokens_list: List[List[str]] = []
         for q_text in query_texts:
-            q_tokens = re.findall(r"\w+", q_text.lower())
+            q_tokens = _TOKEN_RE.findall(q_text.lower())
             query_tokens_list.append(q_tokens)
 
         docs_matrix, scores_matrix = self.bm25.retrieve(query_tokens_list, k=top_k)
@@ -46,14 +46,19 @@ class E5ModelTuned(E5Model):
         data_loader = DataLoader(query_dataset, batch_size=batch_size, num_workers=num_workers, pin_memory=True)
 
         results = {}
+        # sklearn keeps float32 inputs in float32, avoiding a float64 similarity matrix
+        corpus_emb = np.asarray(corpus_emb, dtype=np.float32)
 
         for batch_queries, batch_query_ids in tqdm(data_loader, desc="Processing Queries"):
-            query_embs = self.encode_passages(batch_queries)
+            query_embs = np.asarray(self.encode_passages(batch_queries), dtype=np.float32)
             similarities = cosine_similarity(query_embs, corpus_emb)
+            top_n = min(top_n, similarities.shape[1])
 
             for idx, query_id in enumerate(batch_query_ids):
                 query_similarities = similarities[idx].flatten()
-                top_n_indices = query_similarities.argsort()[-top_n:][::-1]
+                # partial selection of the top_n candidates, then sort only those
+                top_n_indices = np.argpartition(query_similarities, -top_n)[-top_n:]
+                top_n_indices = top_n_indices[np.argsort(-query_similarities[top_n_indices])]
                 top_n_results = {corpus_ids[j]: float(query_similarities[j]) * 100 for j in top_n_indices}
                 results[query_id] = top_n_results
         return results
@@ -0,0 +1,287 @@
+import orjson
+import os
+import pickle
+import requests
+import re
+import sys
+import time
+import unicodedata
+from array import array
+from functools import lru_cache, partial
+from itertools import chain
+from multiprocessing import Pool
+from razdel import sentenize
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+
+# Helpers shared by the scripts building the wikifacts corpora (articles.py, paras.py, sents.py, windows.py)
+
+SENTENCE_CORPUS_PATH = 'sentences.pkl'
+
+_ACCENT_RE = re.compile(r'а́')
+_HEADER_RE = re.compile(r"==\s*(.*?)\s*==\s*")
+_SENTENCE_END_RE = re.compile(r'(?<=[.!?…])\s+')
+_COMBINING = dict.fromkeys(cp for cp in range(sys.maxunicode + 1) if unicodedata.combining(chr(cp)))
+
+@lru_cache(maxsize=262144)
+def preprocess_text(text):
+    text = _ACCENT_RE.sub('а', text)
+    text = _HEADER_RE.sub(r"\1 ", text)
+    text = text.replace('\xa0', ' ').strip()
+    if text.isascii():
+        # Nothing to compose or decompose and no combining marks to strip
+        return text
+    text = unicodedata.normalize('NFC', text)
+    # "й" and "ё" keep their diacritics: they are swapped for noncharacters while the text is decomposed
+    text = text.replace('й', '\ufdd0').replace('ё', '\ufdd1')
+    text = unicodedata.normalize('NFD', text).translate(_COMBINING)
+    return text.replace('\ufdd0', 'й').replace('\ufdd1', 'ё')
+
+
+def regex_sentenize(text):
+    """
+    Splits text into sentences at whitespace following ".", "!", "?" or "…". Much faster than razdel, but unaware of
+    abbreviations and initials, so such sentences get split in two.
+    """
+    return [sentence for sentence in (s.strip() for s in _SENTENCE_END_RE.split(text)) if sentence]
+
+
+WIKI_API_URL = "https://ru.wikipedia.org/w/api.php"
+WIKI_TITLES_PER_REQUEST = 50
+
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
+
+
+def get_wikipedia_articles(titles):
+    """
+    Fetches preprocessed texts of articles, keyed by the requested titles.
+    Titles are queried in batches of 50 through one session. The API returns full-text extracts
+    for a single page per response, the rest of a batch is fetched by following the continuation.
+    """
+    articles = {}
+    for i in range(0, len(titles), WIKI_TITLES_PER_REQUEST):
+        batch = titles[i:i + WIKI_TITLES_PER_REQUEST]
+        params = {
+            "action": "query",
+            "prop": "extracts",
+            "explaintext": True,
+            "format": "json",
+            "maxlag": 5,
+            "titles": "|".join(batch)
+        }
+        normalized = {}
+        extracts = {}
+        continuation = {}
+        while True:
+            response = SESSION.get(WIKI_API_URL, params={**params, **continuation})
+            data = response.json()
+            if data.get('error', {}).get('code') == 'maxlag':
+                time.sleep(int(response.headers.get('Retry-After', 5)))
+                continue
+
+            query = data['query']
+            for item in query.get('normalized', []):
+                normalized[item['from']] = item['to']
+            for page in query['pages'].values():
+                if 'extract' in page:
+                    extracts[page['title']] = page['extract']
+
+            if 'continue' not in data:
+                break
+            continuation = data['continue']
+
+        for title in batch:
+            article_text = extracts.get(normalized.get(title, title), "Текст не найден.")
+            articles[title] = preprocess_text(article_text)
+
+    return articles
+
+
+def extract_article_title(url):
+    parts = url.split('/wiki/')
+    return parts[1] if len(parts) > 1 else None
+
+
+def write_jsonl(path, records, chunk_size=64 << 20):
+    """
+    Writes records as JSON lines, joining them into writes of about chunk_size bytes.
+    """
+    with open(path, 'wb') as f:
+        lines, size = [], 0
+        for record in records:
+            line = orjson.dumps(record)
+            lines.append(line)
+            size += len(line) + 1
+            if size >= chunk_size:
+                f.write(b"\n".join(lines) + b"\n")
+                lines, size = [], 0
+        if lines:
+            f.write(b"\n".join(lines) + b"\n")
+
+
+def write_intervals(path, intervals):
+    """
+    Writes (start, end) intervals as consecutive little-endian int32 pairs.
+    An empty article has end = start - 1, which can be -1, hence the signed type.
+    The file loads into an (n, 2) array with np.fromfile(path, dtype='<i4').reshape(-1, 2).
+    """
+    bounds = array('i', chain.from_iterable(intervals))
+    if sys.byteorder == 'big':
+        bounds.byteswap()
+    with open(path, 'wb') as f:
+        bounds.tofile(f)
+
+
+def find_duplicate_links(link_texts):
+    """
+    Maps every link whose article text is identical to the text of an earlier link to that earlier link.
+    """
+    first_link_by_text = {}
+    duplicate_links = {}
+    for link_url, link_data in link_texts.items():
+        first_link = first_link_by_text.setdefault(link_data, link_url)
+        if first_link != link_url:
+            duplicate_links[link_url] = first_link
+    return duplicate_links
+
+
+def _iter_fact_items(value):
+    if isinstance(value, list):
+        for item in value:
+            yield from _iter_fact_items(item)
+    else:
+        yield value
+
+
+def iter_facts(path):
+    """
+    Yields facts from the wiki corpus file. A JSON line per list of facts is parsed one line at a time,
+    a file holding a single JSON document (a list of such lists) is parsed at once.
+    """
+    with open(path, 'rb') as f:
+        first_line = f.readline()
+        try:
+            orjson.loads(first_line)
+            values = chain([first_line], f)
+        except orjson.JSONDecodeError:
+            values = [first_line + f.read()]
+
+        for value in values:
+            if value.strip():
+                yield from _iter_fact_items(orjson.loads(value))
+
+def sentenize_link(link, segmenter="razdel"):
+    """
+    Splits a linked article into sentences and computes the word sets used for matching facts to them.
+    """
+    link_url, link_data = link
+    article_text = preprocess_text(link_data)
+    if segmenter == "regex":
+        sentences = regex_sentenize(article_text)
+    else:
+        sentences = [sent.text for sent in sentenize(article_text) if sent.text != ""]
+    return link_url, (sentences, [frozenset(preprocess_text(sentence).lower().split()) for sentence in sentences])
+
+
+def build_sentence_corpus(data, segmenter="razdel", dedupe_articles=False):
+    """
+    Builds the sentence-level corpus shared by sents.py and windows.py.
+    Returns the corpus records, their word sets, the sentence id interval of every link and the intervals of every fact.
+    """
+    # Every linked article is preprocessed, split into sentences and tokenized once, in parallel;
+    # the first occurrence of a link provides its text
+    unique_links = {}
+    for item in data:
+        for link_item in item.get("links", []):
+            unique_links.setdefault(link_item.get("link"), link_item.get("link_data", ""))
+
+    # Links repeating the text of an earlier link reuse its sentences instead of being split again
+    duplicate_links = find_duplicate_links(unique_links) if dedupe_articles else {}
+    links_to_split = [(link_url, link_data) for link_url, link_data in unique_links.items()
+                      if link_url not in duplicate_links]
+
+    split_link = partial(sentenize_link, segmenter=segmenter)
+    with Pool(os.cpu_count()) as pool:
+        link_sentences = dict(tqdm(pool.imap_unordered(split_link, links_to_split, chunksize=16),
+                                   total=len(links_to_split), desc="Splitting articles"))
+
+    corpus_list = []
+    corpus_wordsets = []  # word sets of corpus documents, aligned with corpus_list
+    doc_counter = 0
+    processed_links = {}  
+    query_interval = {}   
+    fact_counter = 0
+
+    for item in tqdm(data, total=len(data), desc="Processing facts"):
+        fact_id = f"bwq-{fact_counter}"
+        fact_counter += 1
+        intervals_for_fact = []
+        fact_links = set()  
+
+        links = item.get("links", [])
+        for link_item in links:
+            link_url = link_item.get("link")
+            if link_url in fact_links:
+                continue 
+            fact_links.add(link_url)
+
+            if link_url in processed_links:
+                intervals_for_fact.append(processed_links[link_url])
+                continue
+
+            first_link = duplicate_links.get(link_url)
+            if first_link is not None and first_link in processed_links:
+                processed_links[link_url] = processed_links[first_link]
+                if processed_links[link_url] not in intervals_for_fact:
+                    intervals_for_fact.append(processed_links[link_url])
+                continue
+
+            sentences, wordsets = link_sentences[duplicate_links.get(link_url, link_url)]
+            article_id_start = doc_counter
+            corpus_wordsets.extend(wordsets)
+            for sentence in sentences:
+                doc_id = f"bwc-{doc_counter}"
+                corpus_list.append({"_id": doc_id, "title": "", "text": sentence})
+                doc_counter += 1
+            article_id_end = doc_counter - 1
+
+            interval = (article_id_start, article_id_end)
+            processed_links[link_url] = interval
+            intervals_for_fact.append(interval)
+
+        query_interval[fact_id] = intervals_for_fact
+
+    return corpus_list, corpus_wordsets, processed_links, query_interval
+
+
+def _file_fingerprint(path):
+    """
+    Identifies the current version of a file by its absolute path, size and modification time.
+    """
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+
+def save_sentence_corpus(path, source, corpus_list, processed_links, query_interval, **options):
+    """
+    Pickles the sentence corpus together with the fingerprint of the facts file it was built from
+    and the options it was built with.
+    """
+    with open(path, 'wb') as f:
+        pickle.dump({"source": _file_fingerprint(source), "options": options, "corpus": corpus_list,
+                     "links": processed_links, "query_interval": query_interval}, f, protocol=5)
+
+
+def load_sentence_corpus(path, source, **options):
+    """
+    Loads a sentence corpus saved by save_sentence_corpus.
+    Returns None if there is none, or if it was built from another version of the source file or with other options.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        saved = pickle.load(f)
+    if saved.get("source") != _file_fingerprint(source) or saved["options"] != options:
+        return None
+    return saved["corpus"], saved["links"], saved["query_interval"]
@@ -1,179 +1,220 @@
+import argparse
+import csv
+import importlib.util
 import json
-import requests
-import re
-import unicodedata
-from razdel import sentenize
+import zlib
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+from functools import partial
 from tqdm import tqdm
+from _common import (SENTENCE_CORPUS_PATH, build_sentence_corpus, iter_facts, preprocess_text, save_sentence_corpus,
+                     write_intervals, write_jsonl)
 
-def preprocess_text(text):
-    exclude_chars = "йё"
-    text = re.sub(r'а́', 'а', text)
-    text = re.sub(r"==\s*(.*?)\s*==\s*", r"\1 ", text)
-    text = text.replace('\xa0', ' ').strip()
-    text = unicodedata.normalize('NFC', text)
-    result = []
-    for char in text:
-        if char in exclude_chars:
-            result.append(char)
-        else:
-            char_base = unicodedata.normalize('NFD', char)
-            char_without_diacritics = ''.join(
-                c for c in char_base if not unicodedata.combining(c)
-            )
-            result.append(char_without_diacritics)
-    
-    return ''.join(result)
-
-
-def get_wikipedia_article(article_title):
-    url = f"https://ru.wikipedia.org/w/api.php"
-    params = {
-        "action": "query",
-        "prop": "extracts",
-        "explaintext": True,
-        "format": "json",
-        "titles": article_title
-    }
-
-    response = requests.get(url, params=params)
-    data = response.json()
-
-    pages = data['query']['pages']
-    page = next(iter(pages.values()))
-    article_text = page['extract'] if 'extract' in page else "Текст не найден."
-
-    return preprocess_text(article_text)
-
-
-def extract_article_title(url):
-    parts = url.split('/wiki/')
-    return parts[1] if len(parts) > 1 else None
-
-
-def find_id_by_text(corpus, text, threshold=0.7):
+if importlib.util.find_spec("datasketch") is not None:
+    from datasketch import MinHash, MinHashLSH
+
+MINHASH_NUM_PERM = 64
+SIGNATURE_BITS = 256
+
+
+def find_id_by_text(corpus_list, corpus_wordsets, inv_index, id_range, text, threshold=0.7):
+    """
+    Finds the document of corpus_list from id_range with the highest Jaccard similarity to text.
+    Only documents sharing at least one word with text are scored, ties are resolved in favour of the lowest id.
+    """
+    target_words = set(preprocess_text(text).lower().split())
+    start, end = id_range
+
+    # Posting lists hold corpus positions in increasing order, so the article's part is found by bisection
+    intersections = Counter()
+    for word in target_words:
+        postings = inv_index.get(word)
+        if postings:
+            intersections.update(postings[bisect_left(postings, start):bisect_right(postings, end)])
+
+    best_match_id = None
+    best_similarity = 0
+
+    for pos in sorted(intersections):
+        intersection = intersections[pos]
+        similarity = intersection / (len(target_words) + len(corpus_wordsets[pos]) - intersection)
+
+        if similarity > best_similarity and similarity >= threshold:
+            best_similarity = similarity
+            best_match_id = corpus_list[pos]['_id']
+
+    return best_match_id
+
+
+def build_minhash_lsh(corpus_wordsets, threshold, num_perm=MINHASH_NUM_PERM):
+    """
+    Indexes MinHash signatures of the corpus word sets in an LSH table tuned for the given Jaccard threshold.
+    """
+    if importlib.util.find_spec("datasketch") is None:
+        raise ImportError("minhash matching requires datasketch")
+
+    # Copies of an empty MinHash share its permutations instead of generating them for every document
+    empty_minhash = MinHash(num_perm=num_perm)
+    lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
+    with lsh.insertion_session() as session:
+        for pos, words in enumerate(tqdm(corpus_wordsets, desc="Hashing corpus")):
+            if words:
+                minhash = empty_minhash.copy()
+                minhash.update_batch([word.encode('utf-8') for word in words])
+                session.insert(pos, minhash, check_duplication=False)
+    return lsh, empty_minhash
+
+
+def find_id_by_minhash(corpus_list, corpus_wordsets, minhash_index, id_range, text, threshold=0.7):
+    """
+    Approximate counterpart of find_id_by_text: candidates come from the MinHash LSH table and are confirmed
+    with exact Jaccard similarity. Documents the LSH table misses are not considered.
+    """
+    lsh, empty_minhash = minhash_index
     target_words = set(preprocess_text(text).lower().split())
-    
+    if not target_words:
+        return None
+    start, end = id_range
+
+    minhash = empty_minhash.copy()
+    minhash.update_batch([word.encode('utf-8') for word in target_words])
+
     best_match_id = None
     best_similarity = 0
-    
-    for doc_data in corpus.values():
-        corpus_words = set(preprocess_text(doc_data['text']).lower().split())
-        intersection = len(target_words & corpus_words)
-        union = len(target_words | corpus_words)
-        similarity = intersection / union if union != 0 else 0
-        
+
+    for pos in sorted(pos for pos in lsh.query(minhash) if start <= pos <= end):
+        intersection = len(target_words & corpus_wordsets[pos])
+        similarity = intersection / (len(target_words) + len(corpus_wordsets[pos]) - intersection)
+
         if similarity > best_similarity and similarity >= threshold:
             best_similarity = similarity
-            best_match_id = doc_data['_id']
-    
+            best_match_id = corpus_list[pos]['_id']
+
     return best_match_id
 
-# Loading data
-with open('wiki-corpus.jsonl', 'r', encoding='utf-8') as f:
-    raw_data = json.load(f)
-
-data = [item for sublist in raw_data for item in sublist]
 
-# Creation of queries
-queries = {}
-for idx, item in enumerate(data):
-    query_id = f"bwq-{idx}"
-    queries[query_id] = {"_id": query_id, "text": preprocess_text(item["fact"]), "title": ""}
+def word_signature(words):
+    """
+    Packs a word set into a SIGNATURE_BITS-bit integer, one bit per word chosen by a stable hash of the word.
+    """
+    signature = 0
+    for word in words:
+        signature |= 1 << (zlib.crc32(word.encode('utf-8')) % SIGNATURE_BITS)
+    return signature
+
+
+def find_id_by_signature(corpus_list, doc_signatures, id_range, text, threshold=0.7):
+    """
+    Approximate counterpart of find_id_by_text: the Jaccard similarity of word bit-signatures stands in for
+    the similarity of word sets. Hash collisions between words make it a two-sided approximation: it can both
+    miss matches above the threshold and accept ones below it.
+    """
+    target_signature = word_signature(set(preprocess_text(text).lower().split()))
+    start, end = id_range
+
+    best_match_id = None
+    best_similarity = 0
+
+    for pos in range(start, end + 1):
+        union = (target_signature | doc_signatures[pos]).bit_count()
+        similarity = (target_signature & doc_signatures[pos]).bit_count() / union if union != 0 else 0
+
+        if similarity > best_similarity and similarity >= threshold:
+            best_similarity = similarity
+            best_match_id = corpus_list[pos]['_id']
+
+    return best_match_id
 
 
-with open('queries.jsonl', 'w', encoding='utf-8') as f:
-    for record in queries.values():
-        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--match", choices=["exact", "minhash", "signature"], default="exact",
+                        help="How facts are matched to corpus sentences: exact Jaccard over an inverted index, "
+                             "MinHash LSH candidates confirmed by exact Jaccard (approximate, needs datasketch) "
+                             "or Jaccard over 256-bit word signatures (approximate)")
+    parser.add_argument("--dedupe-articles", action="store_true",
+                        help="Give links with identical article texts the sentences of the first such link "
+                             "instead of adding the article to the corpus again")
+    parser.add_argument("--segmenter", choices=["razdel", "regex"], default="razdel",
+                        help="Sentence splitter: razdel, or a faster punctuation regex that splits more eagerly "
+                             "(changes the corpus, windows.py must be run with the same choice)")
+    args = parser.parse_args()
 
-# Creation of corpus and link_intervals
-corpus = {}
-doc_counter = 0
-processed_links = {}  
-query_interval = {}   
-fact_counter = 0
+    # Loading data
+    data = list(iter_facts('wiki-corpus.jsonl'))
 
-for item in tqdm(data, total=len(data), desc="Processing facts"):
-    fact_id = f"bwq-{fact_counter}"
-    fact_counter += 1
-    intervals_for_fact = []
-    fact_links = set()  
+    # Creation of queries
+    queries = {}
+    for idx, item in enumerate(data):
+        query_id = f"bwq-{idx}"
+        queries[query_id] = {"_id": query_id, "text": preprocess_text(item["fact"]), "title": ""}
 
-    links = item.get("links", [])
-    for link_item in links:
-        link_url = link_item.get("link")
-        if link_url in fact_links:
-            continue 
-        fact_links.add(link_url)
 
-        if link_url in processed_links:
-            intervals_for_fact.append(processed_links[link_url])
-            continue
+    write_jsonl('queries.jsonl', queries.values())
 
-        article_text = preprocess_text(link_item.get("link_data"))
-        sentences = [sent.text for sent in sentenize(article_text)]
+    corpus_list, corpus_wordsets, processed_links, query_interval = build_sentence_corpus(
+        data, segmenter=args.segmenter, dedupe_articles=args.dedupe_articles)
+    save_sentence_corpus(SENTENCE_CORPUS_PATH, 'wiki-corpus.jsonl', corpus_list, processed_links, query_interval,
+                         segmenter=args.segmenter, dedupe_articles=args.dedupe_articles)
 
-        article_id_start = doc_counter
-        for sentence in sentences:
-            if sentence == "":
-                continue
-            doc_id = f"bwc-{doc_counter}"
-            corpus[doc_id] = {"_id": doc_id, "title": "", "text": sentence}
-            doc_counter += 1
-        article_id_end = doc_counter - 1
+    with open('queries_interval.json', 'w', encoding='utf-8') as f:
+        json.dump(query_interval, f, ensure_ascii=False, indent=4)
 
-        interval = (article_id_start, article_id_end)
-        processed_links[link_url] = interval
-        intervals_for_fact.append(interval)
+    write_jsonl('corpus.jsonl', corpus_list)
 
-    query_interval[fact_id] = intervals_for_fact
+    write_jsonl('link_intervals.jsonl', processed_links.values())
+    write_intervals('link_intervals.bin', processed_links.values())
 
+    if args.match == "minhash":
+        find_id = partial(find_id_by_minhash, corpus_list, corpus_wordsets,
+                          build_minhash_lsh(corpus_wordsets, threshold=0.2))
+    elif args.match == "signature":
+        doc_signatures = [word_signature(words) for words in corpus_wordsets]
+        find_id = partial(find_id_by_signature, corpus_list, doc_signatures)
+    else:
+        # Inverted index word -> positions of documents containing it
+        inv_index = defaultdict(list)
+        for pos, words in enumerate(corpus_wordsets):
+            for word in words:
+                inv_index[word].append(pos)
+        find_id = partial(find_id_by_text, corpus_list, corpus_wordsets, inv_index)
 
-with open('queries_interval.json', 'w', encoding='utf-8') as f:
-    json.dump(query_interval, f, ensure_ascii=False, indent=4)
+    # Creation of qrels (relevance markup)
+    qrels_rows = []
+    not_found_lines = []
 
-with open('corpus.jsonl', 'w', encoding='utf-8') as f:
-    for record in corpus.values():
-        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    for idx, item in tqdm(enumerate(data), total=len(data), desc="Creating qrels"):
+        query_id = f"bwq-{idx}"
+        links = item.get("links", [])
+        for link_item in links:
+            article_url = link_item.get("link")
+            article_id_start, article_id_end = processed_links.get(article_url, (None, None))
 
-with open('link_intervals.jsonl', 'w', encoding='utf-8') as f:
-    for record in processed_links.values():
-        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if article_id_start is None or article_id_end is None:
+                continue 
 
-# Creation of qrels (relevance markup)
-qrels_lines = []
-not_found_lines = []
+            for score_item in link_item.get("scores", []):
+                score_text = score_item.get("text")
+                relevance = score_item.get("score")
 
-for idx, item in tqdm(enumerate(data), total=len(data), desc="Creating qrels"):
-    query_id = f"bwq-{idx}"
-    links = item.get("links", [])
-    for link_item in links:
-        article_url = link_item.get("link")
-        article_id_start, article_id_end = processed_links.get(article_url, (None, None))
+                if int(relevance) == 0:
+                    continue  
 
-        if article_id_start is None or article_id_end is None:
-            continue 
+                doc_id = find_id((article_id_start, article_id_end), score_text, threshold=0.2)
 
-        for score_item in link_item.get("scores", []):
-            score_text = score_item.get("text")
-            relevance = score_item.get("score")
+                if doc_id:
+                    qrels_rows.append((query_id, doc_id, relevance))
+                else:
+                    not_found_lines.append({"query_id": query_id, "score_text": score_text, "relevance": relevance})
 
-            if int(relevance) == 0:
-                continue  
 
-            doc_id = find_id_by_text({k: v for k, v in corpus.items() if article_id_start <= int(k.split('-')[1]) <= article_id_end}, score_text, threshold=0.2)
-            
-            if doc_id:
-                qrels_lines.append(f"{query_id}\t{doc_id}\t{relevance}")
-            else:
-                not_found_lines.append({"query_id": query_id, "score_text": score_text, "relevance": relevance})
+    with open('qrels.tsv', 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, delimiter='\t', lineterminator='\n')
+        writer.writerow(("query-id", "corpus-id", "score"))
+        writer.writerows(qrels_rows)
 
+    write_jsonl('not_found.jsonl', not_found_lines)
 
-with open('qrels.tsv', 'w', encoding='utf-8') as f:
-    f.write("query-id\tcorpus-id\tscore\n")
-    for line in qrels_lines:
-        f.write(line + "\n")
-
-with open('not_found.jsonl', 'w', encoding='utf-8') as f:
-    for line in not_found_lines:
-        f.write(json.dumps(line, ensure_ascii=False) + "\n")
 
+if __name__ == "__main__":
+    main()